@@ -1,9 +1,21 @@
+import asyncio
+import concurrent.futures
 import datetime
+import hashlib
+import http.cookiejar
+import importlib.util
 import os
+import random
+import threading
+import time
+import httpx
 import pytz
 from dotenv import load_dotenv
-from notion_client import Client
+from notion_client import AsyncClient
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
 import myfitnesspal
+from myfitnesspal.exceptions import MyfitnesspalLoginError
+import browser_cookie3
 
 # Load environment variables from .env file
 load_dotenv()
@@ -29,22 +41,213 @@ NOTION_PROTEIN_PROP = "Protein (g)"
 NOTION_CARBS_PROP = "Carbs (g)"
 NOTION_FATS_PROP = "Fats (g)"
 NOTION_WATER_PROP = "Water (ml)" # Optional
+NOTION_HASH_PROP = "Sync Hash" # Optional text property used to skip unchanged days
+NOTION_LAST_SYNC_PROP = "Last Synced" # Optional date property used to skip recently synced past days
+
+# Past days synced more recently than this are not fetched from MyFitnessPal again.
+SYNC_TTL = datetime.timedelta(hours=6)
+
+# Notion number properties and the MyFitnessPal data keys they are filled from
+NOTION_NUMBER_PROPS = (
+    (NOTION_CALS_IN_PROP, "calories_in"),
+    (NOTION_CALS_OUT_PROP, "calories_out_exercise"),
+    (NOTION_NET_CALS_PROP, "net_calories"),
+    (NOTION_PROTEIN_PROP, "protein"),
+    (NOTION_CARBS_PROP, "carbs"),
+    (NOTION_FATS_PROP, "fats"),
+)
+
+# Properties compared against the existing Notion entry, including the optional water property
+NOTION_COMPARED_PROPS, NOTION_COMPARED_KEYS = zip(*NOTION_NUMBER_PROPS, (NOTION_WATER_PROP, "water_ml"))
+
+# Maximum number of Notion writes (and pooled connections) in flight at the same time.
+NOTION_MAX_CONCURRENCY = 5
+# Notion allows an average of ~3 requests per second per integration.
+NOTION_MAX_PER_SECOND = 3
+# Attempts made for a Notion request that is rate limited (or, if safe to repeat, times out or hits a server error).
+NOTION_MAX_ATTEMPTS = 6
+NOTION_MAX_BACKOFF_SECONDS = 30
+# With the optional `h2` package installed (pip install "httpx[http2]"), all Notion
+# requests are multiplexed over a single HTTP/2 connection instead of a connection pool.
+NOTION_HTTP2 = importlib.util.find_spec("h2") is not None
+
+# Maximum number of dates fetched from MyFitnessPal at the same time.
+MFP_MAX_WORKERS = 8
+
+# Holds one MyFitnessPal client per worker thread, as the underlying
+# requests session is not guaranteed to be thread-safe.
+_mfp_thread_local = threading.local()
+
+# MyFitnessPal login cookies are cached here so later runs can skip scanning browser cookie stores
+MFP_COOKIE_CACHE_PATH = os.path.expanduser("~/.cache/garmin-to-notion/mfp_cookies.txt")
+_mfp_cookie_lock = threading.Lock()
+
+class NotionThrottle:
+    """
+    Async context manager limiting Notion requests both in flight and per second.
+    """
+    def __init__(self, max_at_once, max_per_second):
+        self._semaphore = asyncio.Semaphore(max_at_once)
+        self._interval = 1 / max_per_second
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        try:
+            # Reserve the next start slot, then wait for it outside the lock
+            async with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start)
+                self._next_start = start + self._interval
+            await asyncio.sleep(start - now)
+        except BaseException:
+            # __aexit__ won't run if we're cancelled while waiting
+            self._semaphore.release()
+            raise
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+
+async def call_notion(method, idempotent=True, **kwargs):
+    """
+    Calls a Notion client method, retrying with exponential backoff on
+    rate limits (429), and for idempotent calls also on server errors (5xx)
+    and timeouts.
+    Args:
+        method: An async Notion client method, e.g. notion_client.pages.update.
+        idempotent: Whether the call is safe to repeat. Creates are not: a create
+            that timed out or failed with a 5xx may still have been written.
+        kwargs: Arguments passed to the method.
+    Returns:
+        The Notion API response.
+    """
+    for attempt in range(1, NOTION_MAX_ATTEMPTS + 1):
+        try:
+            return await method(**kwargs)
+        except (HTTPResponseError, RequestTimeoutError) as e:
+            status = getattr(e, "status", None)
+            # Notion guarantees a rate-limited request was not processed
+            retryable = status == 429 or (idempotent and (status is None or status >= 500))
+            if not retryable or attempt == NOTION_MAX_ATTEMPTS:
+                raise
+            retry_after = e.headers.get("Retry-After") if status else None
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                # Missing, or an HTTP-date rather than seconds
+                delay = 2 ** (attempt - 1) + random.uniform(0, 1)
+            delay = min(NOTION_MAX_BACKOFF_SECONDS, max(0, delay))
+            print(f"Notion request failed ({status or 'timeout'}), retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
+class AdaptiveBatcher:
+    """
+    Chooses how many days each Notion date-range query should cover.
+    The window grows towards roughly `target_results` pages per query and
+    shrinks again whenever a query takes longer than `max_seconds`.
+    """
+    def __init__(self, initial_days=7, target_results=100, min_days=1, max_days=90,
+                 max_seconds=2.0, growth=0.9):
+        self.days = initial_days
+        self.target_results = target_results
+        self.min_days = min_days
+        self.max_days = max_days
+        self.max_seconds = max_seconds
+        self.growth = growth
+
+    def record(self, results, elapsed):
+        """
+        Updates the window size from the outcome of the last query.
+        Args:
+            results: Number of pages the last query returned.
+            elapsed: Time the last query took, in seconds.
+        """
+        if results:
+            days = self.days * self.growth * (self.target_results / results)
+        else:
+            days = self.days * 2 # Empty window, grow geometrically
+        if elapsed > self.max_seconds:
+            days = min(days, self.days * self.max_seconds / elapsed)
+        self.days = max(self.min_days, min(self.max_days, int(days)))
+
+def get_cookie_cache_mtime():
+    """
+    Returns the modification time of the cookie cache, or None if there is no cache.
+    """
+    try:
+        return os.stat(MFP_COOKIE_CACHE_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+def save_mfp_cookie_cache(cookiejar):
+    """
+    Writes the cookies to the cache file, readable only by the current user.
+    Args:
+        cookiejar: An LWPCookieJar holding the MyFitnessPal cookies.
+    """
+    # Cookies are login credentials, so never let the file be readable by others,
+    # not even briefly (LWPCookieJar.save would create it under the process umask)
+    os.makedirs(os.path.dirname(MFP_COOKIE_CACHE_PATH), mode=0o700, exist_ok=True)
+    fd = os.open(MFP_COOKIE_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        os.fchmod(fd, 0o600) # Tighten caches written by older versions
+        f.write("#LWP-Cookies-2.0\n")
+        f.write(cookiejar.as_lwp_str(ignore_discard=True, ignore_expires=True))
+
+def get_mfp_cookiejar(rejected_mtime=None):
+    """
+    Returns the MyFitnessPal login cookies, loading them from the local cache when possible.
+    Args:
+        rejected_mtime: Cache modification time of cookies MyFitnessPal rejected. The
+            browser is scanned again unless another thread has already refreshed the cache.
+    Returns:
+        A tuple of the cookie jar, the cache modification time it matches and
+        whether it was loaded from the cache (rather than freshly scanned).
+    """
+    with _mfp_cookie_lock:
+        cookiejar = http.cookiejar.LWPCookieJar(MFP_COOKIE_CACHE_PATH)
+        cache_mtime = get_cookie_cache_mtime()
+        if cache_mtime is not None and cache_mtime != rejected_mtime:
+            try:
+                cookiejar.load(ignore_discard=True, ignore_expires=True)
+                return cookiejar, cache_mtime, True
+            except OSError as e: # Includes http.cookiejar.LoadError
+                print(f"Ignoring unreadable MyFitnessPal cookie cache: {e}")
+                cookiejar.clear()
+
+        # Scan the default browsers' cookie stores (slow) and cache the result
+        # If you want a specific browser, use e.g. browser_cookie3.chrome() or .firefox()
+        for cookie in browser_cookie3.load(domain_name="myfitnesspal.com"):
+            cookiejar.set_cookie(cookie)
+        save_mfp_cookie_cache(cookiejar)
+        return cookiejar, get_cookie_cache_mtime(), False
 
 def get_mfp_client():
     """
     Initializes and returns the MyFitnessPal client.
-    Relies on browser_cookie3 to find login cookies.
+    Relies on browser_cookie3 to find login cookies, which are cached between runs.
     The user must be logged into MyFitnessPal in their default browser.
     """
     # username = os.getenv("MYFITNESSPAL_USERNAME") # Not strictly needed for cookie auth
-    # client = myfitnesspal.Client(username)
-    # If the above doesn't work due to cookie issues or you want specific browser:
-    # import browser_cookie3
-    # cj = browser_cookie3.chrome() # Or .firefox(), .edge(), etc.
-    # client = myfitnesspal.Client(cookiejar=cj)
-
-    # Default client, attempts to find cookies from common browsers
-    client = myfitnesspal.Client()
+    cookiejar, cache_mtime, from_cache = get_mfp_cookiejar()
+    try:
+        return myfitnesspal.Client(cookiejar=cookiejar)
+    except MyfitnesspalLoginError:
+        if not from_cache:
+            raise # Just scanned the browser, scanning again would find the same cookies
+        # Cached cookies may have expired, read them from the browser again
+        # (only once, even if several worker threads get here)
+        cookiejar, _, _ = get_mfp_cookiejar(rejected_mtime=cache_mtime)
+        return myfitnesspal.Client(cookiejar=cookiejar)
+
+def get_thread_mfp_client():
+    """
+    Returns the MyFitnessPal client for the current thread, creating it on first use.
+    """
+    client = getattr(_mfp_thread_local, "client", None)
+    if client is None:
+        client = _mfp_thread_local.client = get_mfp_client()
     return client
 
 def get_mfp_data_for_date(client, target_date):
@@ -56,11 +259,13 @@ def get_mfp_data_for_date(client, target_date):
     Returns:
         A dictionary containing the nutritional data, or None if an error occurs.
     """
+    _round = round # Local lookup for the payload below
+    date_str = target_date.isoformat()
     try:
         day = client.get_date(target_date.year, target_date.month, target_date.day)
 
         if not day:
-            print(f"No data found for {target_date.strftime('%Y-%m-%d')}")
+            print(f"No data found for {date_str}")
             return None
 
         calories_in = day.totals.get('calories', 0)
@@ -73,11 +278,12 @@ def get_mfp_data_for_date(client, target_date):
         water_ml = client.get_water(target_date) # Fetches water intake in ml
 
         # Calculate Calories Out from exercises
-        calories_out_exercise = 0
-        if day.exercises:
-            for exercise_group in day.exercises: # day.exercises is a list of Exercise objects
-                for entry in exercise_group.entries: # Each Exercise has entries
-                     calories_out_exercise += entry.nutrition_information.get('calories burned', 0)
+        # day.exercises is a list of Exercise objects, each with its own entries
+        calories_out_exercise = sum(
+            entry.nutrition_information.get('calories burned', 0)
+            for exercise_group in (day.exercises or ())
+            for entry in exercise_group.entries
+        )
 
 
         net_calories = calories_in - calories_out_exercise # This is a simple net
@@ -89,45 +295,120 @@ def get_mfp_data_for_date(client, target_date):
         # mfp_remaining_calories = mfp_goal_calories - calories_in + calories_out_exercise
 
         return {
-            "date": target_date.strftime('%Y-%m-%d'),
-            "calories_in": round(calories_in or 0),
-            "calories_out_exercise": round(calories_out_exercise or 0),
-            "net_calories": round(net_calories or 0),
-            "protein": round(protein or 0),
-            "carbs": round(carbs or 0),
-            "fats": round(fats or 0),
-            "water_ml": water_ml if water_ml is not None else 0
+            "date": date_str,
+            "calories_in": _round(calories_in or 0),
+            "calories_out_exercise": _round(calories_out_exercise or 0),
+            "net_calories": _round(net_calories or 0),
+            "protein": _round(protein or 0),
+            "carbs": _round(carbs or 0),
+            "fats": _round(fats or 0),
+            "water_ml": _round(water_ml or 0)
         }
     except Exception as e:
-        print(f"Error fetching MyFitnessPal data for {target_date.strftime('%Y-%m-%d')}: {e}")
+        print(f"Error fetching MyFitnessPal data for {date_str}: {e}")
         return None
 
-def entry_exists(notion_client, database_id, entry_date_str):
+def fetch_mfp_data(dates):
+    """
+    Fetches MyFitnessPal nutritional data for several dates concurrently.
+    Args:
+        dates: A list of datetime.date objects.
+    Returns:
+        A dictionary mapping each date to its nutritional data (or None).
+    Raises:
+        Any error raised while initializing the MyFitnessPal client.
+    """
+    def fetch(target_date):
+        return get_mfp_data_for_date(get_thread_mfp_client(), target_date)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(MFP_MAX_WORKERS, len(dates))) as executor:
+        return dict(zip(dates, executor.map(fetch, dates)))
+
+async def query_date_range(notion_client, database_id, start_date, end_date):
     """
-    Checks if an entry for the given date already exists in the Notion database.
+    Queries all entries between two dates (inclusive), following pagination.
     Args:
-        notion_client: The Notion client.
+        notion_client: The async Notion client.
         database_id: The ID of the Notion database.
-        entry_date_str: The date string in 'YYYY-MM-DD' format.
+        start_date: The first datetime.date to include.
+        end_date: The last datetime.date to include.
     Returns:
-        The Notion page object if it exists, otherwise None.
+        A list of Notion page objects.
     """
-    try:
-        response = notion_client.databases.query(
-            database_id=database_id,
-            filter={
-                "property": NOTION_DATE_PROP,
-                "date": {
-                    "equals": entry_date_str,
-                }
-            }
-        )
-        if response and response['results']:
-            return response['results'][0]
-        return None
-    except Exception as e:
-        print(f"Error checking if entry exists for {entry_date_str}: {e}")
-        return None
+    query = {
+        "database_id": database_id,
+        "filter": {
+            "and": [
+                {"property": NOTION_DATE_PROP, "date": {"on_or_after": start_date.isoformat()}},
+                {"property": NOTION_DATE_PROP, "date": {"before": (end_date + datetime.timedelta(days=1)).isoformat()}}
+            ]
+        }
+    }
+    pages = []
+    while True:
+        response = await call_notion(notion_client.databases.query, **query)
+        pages.extend(response['results'])
+        if not response['has_more']:
+            return pages
+        query["start_cursor"] = response['next_cursor']
+
+async def fetch_existing_pages(notion_client, database_id, start_date, end_date):
+    """
+    Fetches every entry between two dates (inclusive) using date-range queries.
+    Long ranges are split into windows sized by an AdaptiveBatcher.
+    Args:
+        notion_client: The async Notion client.
+        database_id: The ID of the Notion database.
+        start_date: The first datetime.date to include.
+        end_date: The last datetime.date to include.
+    Returns:
+        A dictionary mapping 'YYYY-MM-DD' date strings to Notion page objects.
+    Raises:
+        Any error from the Notion queries, since an incomplete index would
+        cause duplicate entries to be created.
+    """
+    batcher = AdaptiveBatcher()
+    pages_by_date = {}
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(end_date, window_start + datetime.timedelta(days=batcher.days - 1))
+        started = time.monotonic()
+        pages = await query_date_range(notion_client, database_id, window_start, window_end)
+        batcher.record(len(pages), time.monotonic() - started)
+
+        for page in pages:
+            page_date = page['properties'][NOTION_DATE_PROP]['date']
+            if page_date:
+                # Date may include a time component; key on the day only
+                pages_by_date.setdefault(page_date['start'][:10], page)
+        window_start = window_end + datetime.timedelta(days=1)
+    return pages_by_date
+
+async def get_database_properties(notion_client, database_id, existing_pages):
+    """
+    Returns the names of the properties defined on the Notion database.
+    Pages carry every database property, so an existing page is used when available.
+    Args:
+        notion_client: The async Notion client.
+        database_id: The ID of the Notion database.
+        existing_pages: A dictionary of existing Notion page objects.
+    Returns:
+        A set of property names.
+    """
+    for page in existing_pages.values():
+        return set(page['properties'])
+    database = await call_notion(notion_client.databases.retrieve, database_id=database_id)
+    return set(database['properties'])
+
+def compute_sync_hash(mfp_data):
+    """
+    Computes a short, stable hash of a day of MyFitnessPal data.
+    Args:
+        mfp_data: A dictionary of MyFitnessPal data for the day.
+    Returns:
+        A hex digest string.
+    """
+    return hashlib.blake2b(repr(sorted(mfp_data.items())).encode(), digest_size=8).hexdigest()
 
 def entry_needs_update(existing_page, new_data):
     """
@@ -140,45 +421,74 @@ def entry_needs_update(existing_page, new_data):
     """
     props = existing_page['properties']
 
-    # Helper to safely get number from Notion property
-    def get_notion_number(prop_name):
-        if prop_name in props and props[prop_name]['number'] is not None:
-            return props[prop_name]['number']
-        return 0 # Default to 0 if property missing or None
-
-    if (get_notion_number(NOTION_CALS_IN_PROP) != new_data["calories_in"] or
-            get_notion_number(NOTION_CALS_OUT_PROP) != new_data["calories_out_exercise"] or
-            get_notion_number(NOTION_NET_CALS_PROP) != new_data["net_calories"] or
-            get_notion_number(NOTION_PROTEIN_PROP) != new_data["protein"] or
-            get_notion_number(NOTION_CARBS_PROP) != new_data["carbs"] or
-            get_notion_number(NOTION_FATS_PROP) != new_data["fats"] or
-            (NOTION_WATER_PROP in props and get_notion_number(NOTION_WATER_PROP) != new_data["water_ml"])):
-        return True
-    # If water prop doesn't exist yet, and new data has water, it needs update
-    if NOTION_WATER_PROP not in props and new_data.get("water_ml", 0) > 0:
-        return True
-    return False
-
-def create_notion_entry(notion_client, database_id, mfp_data):
+    # Unchanged days carry the same hash as the data that was last synced
+    hash_text = (props.get(NOTION_HASH_PROP) or {}).get('rich_text') or []
+    if ''.join(text['plain_text'] for text in hash_text) == compute_sync_hash(new_data):
+        return False
+
+    # Missing or empty Notion properties count as 0, so a missing water
+    # property only triggers an update when there is water to record.
+    # Values are rounded to integers since Notion hands numbers back as floats.
+    existing = tuple(round((props.get(prop) or {}).get('number') or 0) for prop in NOTION_COMPARED_PROPS)
+    new = tuple(round(new_data[key]) for key in NOTION_COMPARED_KEYS)
+    return existing != new
+
+def build_last_synced_property():
+    """
+    Builds the Notion property stamping an entry as synced now.
+    Returns:
+        A dictionary with the Last Synced property payload.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+    return {NOTION_LAST_SYNC_PROP: {"date": {"start": now}}}
+
+def is_recently_synced(existing_page, now):
+    """
+    Checks whether an existing Notion entry was synced within SYNC_TTL.
+    Args:
+        existing_page: The existing Notion page object.
+        now: The current time as a timezone-aware datetime.
+    Returns:
+        True if the entry was synced recently, False otherwise.
+    """
+    last_synced = (existing_page['properties'].get(NOTION_LAST_SYNC_PROP) or {}).get('date')
+    if not last_synced:
+        return False
+    synced_at = datetime.datetime.fromisoformat(last_synced['start'].replace("Z", "+00:00"))
+    if synced_at.tzinfo is None:
+        synced_at = synced_at.replace(tzinfo=datetime.timezone.utc)
+    return now - synced_at < SYNC_TTL
+
+def build_entry_properties(mfp_data, database_props):
+    """
+    Builds the Notion number, sync hash and last synced properties for a day of MyFitnessPal data.
+    Args:
+        mfp_data: A dictionary of MyFitnessPal data for the day.
+        database_props: Names of the properties defined on the Notion database.
+    Returns:
+        A dictionary of Notion property payloads.
+    """
+    properties = {prop: {"number": mfp_data[key]} for prop, key in NOTION_NUMBER_PROPS}
+    if mfp_data.get("water_ml") is not None: # Ensure water data is available
+        properties[NOTION_WATER_PROP] = {"number": mfp_data["water_ml"]}
+    # Notion rejects writes naming a property the database doesn't have
+    if NOTION_HASH_PROP in database_props:
+        properties[NOTION_HASH_PROP] = {"rich_text": [{"text": {"content": compute_sync_hash(mfp_data)}}]}
+    if NOTION_LAST_SYNC_PROP in database_props:
+        properties.update(build_last_synced_property())
+    return properties
+
+async def create_notion_entry(notion_client, database_id, mfp_data, database_props):
     """
     Creates a new entry in the Notion database.
     Args:
-        notion_client: The Notion client.
+        notion_client: The async Notion client.
         database_id: The ID of the Notion database.
         mfp_data: A dictionary of MyFitnessPal data for the day.
+        database_props: Names of the properties defined on the Notion database.
     """
-    properties = {
-        NOTION_DATE_PROP: {"date": {"start": mfp_data["date"]}},
-        NOTION_CALS_IN_PROP: {"number": mfp_data["calories_in"]},
-        NOTION_CALS_OUT_PROP: {"number": mfp_data["calories_out_exercise"]},
-        NOTION_NET_CALS_PROP: {"number": mfp_data["net_calories"]},
-        NOTION_PROTEIN_PROP: {"number": mfp_data["protein"]},
-        NOTION_CARBS_PROP: {"number": mfp_data["carbs"]},
-        NOTION_FATS_PROP: {"number": mfp_data["fats"]},
-    }
-    if "water_ml" in mfp_data and mfp_data["water_ml"] is not None : # Ensure water data is available
-         properties[NOTION_WATER_PROP] = {"number": mfp_data["water_ml"]}
-
+    properties = build_entry_properties(mfp_data, database_props)
+    properties[NOTION_DATE_PROP] = {"date": {"start": mfp_data["date"]}}
 
     page_data = {
         "parent": {"database_id": database_id},
@@ -187,44 +497,82 @@ def create_notion_entry(notion_client, database_id, mfp_data):
         "icon": {"type": "emoji", "emoji": "🍎"}
     }
     try:
-        notion_client.pages.create(**page_data)
+        await call_notion(notion_client.pages.create, idempotent=False, **page_data)
         print(f"Successfully created Notion entry for {mfp_data['date']}.")
     except Exception as e:
         print(f"Error creating Notion entry for {mfp_data['date']}: {e}")
         print(f"Page data submitted: {page_data}")
 
 
-def update_notion_entry(notion_client, page_id, mfp_data):
+async def update_notion_entry(notion_client, page_id, mfp_data, database_props):
     """
     Updates an existing entry in the Notion database.
     Args:
-        notion_client: The Notion client.
+        notion_client: The async Notion client.
         page_id: The ID of the Notion page to update.
         mfp_data: A dictionary of MyFitnessPal data for the day.
+        database_props: Names of the properties defined on the Notion database.
     """
-    properties = {
-        NOTION_CALS_IN_PROP: {"number": mfp_data["calories_in"]},
-        NOTION_CALS_OUT_PROP: {"number": mfp_data["calories_out_exercise"]},
-        NOTION_NET_CALS_PROP: {"number": mfp_data["net_calories"]},
-        NOTION_PROTEIN_PROP: {"number": mfp_data["protein"]},
-        NOTION_CARBS_PROP: {"number": mfp_data["carbs"]},
-        NOTION_FATS_PROP: {"number": mfp_data["fats"]},
-    }
-    if "water_ml" in mfp_data and mfp_data["water_ml"] is not None : # Ensure water data is available
-         properties[NOTION_WATER_PROP] = {"number": mfp_data["water_ml"]}
+    properties = build_entry_properties(mfp_data, database_props)
 
     update_data = {
         "page_id": page_id,
         "properties": properties,
     }
     try:
-        notion_client.pages.update(**update_data)
+        await call_notion(notion_client.pages.update, **update_data)
         print(f"Successfully updated Notion entry for {mfp_data['date']}.")
     except Exception as e:
         print(f"Error updating Notion entry for {mfp_data['date']} (Page ID: {page_id}): {e}")
         print(f"Update data submitted: {update_data}")
 
-def main():
+async def stamp_notion_entry(notion_client, page_id, date_str):
+    """
+    Marks an unchanged Notion entry as synced without touching its data.
+    Args:
+        notion_client: The async Notion client.
+        page_id: The ID of the Notion page to update.
+        date_str: The date string of the entry, for logging.
+    """
+    try:
+        await call_notion(notion_client.pages.update, page_id=page_id, properties=build_last_synced_property())
+    except Exception as e:
+        print(f"Error updating {NOTION_LAST_SYNC_PROP} for {date_str} (Page ID: {page_id}): {e}")
+
+async def process_date(notion_client, throttle, mfp_data, existing_page, is_past_day, database_props):
+    """
+    Creates or updates the Notion entry for a single day of MyFitnessPal data.
+    Args:
+        notion_client: The async Notion client.
+        throttle: A NotionThrottle shared by all Notion writes.
+        mfp_data: A dictionary of MyFitnessPal data for the day.
+        existing_page: The existing Notion page for the day, or None.
+        is_past_day: Whether the day is before today, so it can be skipped once stamped.
+        database_props: Names of the properties defined on the Notion database.
+    """
+    date_str = mfp_data["date"]
+    print(f"\n--- Processing: {date_str} ---")
+
+    if existing_page:
+        print(f"Found existing Notion page (ID: {existing_page['id']}) for {date_str}.")
+        # If exists, check if update is needed
+        if entry_needs_update(existing_page, mfp_data):
+            print(f"Changes detected. Updating Notion entry for {date_str}...")
+            async with throttle:
+                await update_notion_entry(notion_client, existing_page['id'], mfp_data, database_props)
+        else:
+            print(f"No changes detected. Notion entry for {date_str} is up to date.")
+            if is_past_day and NOTION_LAST_SYNC_PROP in database_props:
+                # Stamp the entry so later runs can skip this day entirely
+                async with throttle:
+                    await stamp_notion_entry(notion_client, existing_page['id'], date_str)
+    else:
+        # If not exists, create new entry
+        print(f"No existing Notion entry found for {date_str}. Creating new one...")
+        async with throttle:
+            await create_notion_entry(notion_client, NOTION_DATABASE_ID, mfp_data, database_props)
+
+async def main():
     # --- Check for required environment variables ---
     if not NOTION_TOKEN:
         print("Error: NOTION_TOKEN environment variable not set.")
@@ -236,24 +584,6 @@ def main():
 
     print("Starting MyFitnessPal to Notion sync...")
 
-    # Initialize MyFitnessPal client
-    print("Initializing MyFitnessPal client...")
-    try:
-        mfp_client = get_mfp_client()
-        # Test with a simple call to ensure client is working (optional)
-        # This might fail if not logged in via browser / cookies not found
-        # print(f"MyFitnessPal client initialized. Username (if available): {mfp_client.username}")
-    except Exception as e:
-        print(f"Failed to initialize MyFitnessPal client: {e}")
-        print("Please ensure you are logged into MyFitnessPal in your web browser,")
-        print("and that the `python-myfitnesspal` library can access its cookies.")
-        print("You might need to install a specific browser cookie library like `pip install browser_cookie3`.")
-        return
-
-    # Initialize Notion client
-    print("Initializing Notion client...")
-    notion = Client(auth=NOTION_TOKEN)
-
     # --- Date Configuration ---
     # Sync data for today in the local timezone.
     # You can modify this to sync a range of dates or a specific date.
@@ -262,40 +592,78 @@ def main():
     # Example: Sync last 7 days
     # dates_to_sync = [(today_local - datetime.timedelta(days=i)) for i in range(7)]
 
+    date_strs = {d: d.isoformat() for d in dates_to_sync}
 
-    print(f"Attempting to sync data for date(s): {[d.strftime('%Y-%m-%d') for d in dates_to_sync]}")
-
-    for target_date in dates_to_sync:
-        date_str = target_date.strftime('%Y-%m-%d')
-        print(f"\n--- Processing: {date_str} ---")
+    print(f"Attempting to sync data for date(s): {list(date_strs.values())}")
 
-        # 1. Get data from MyFitnessPal
-        mfp_data = get_mfp_data_for_date(mfp_client, target_date)
-
-        if not mfp_data:
-            print(f"Skipping Notion update for {date_str} due to missing MFP data.")
-            continue
-
-        print(f"MyFitnessPal data for {date_str}: {mfp_data}")
-
-        # 2. Check if entry exists in Notion
-        print(f"Checking for existing Notion entry for {date_str}...")
-        existing_page = entry_exists(notion, NOTION_DATABASE_ID, date_str)
-
-        if existing_page:
-            print(f"Found existing Notion page (ID: {existing_page['id']}) for {date_str}.")
-            # 3a. If exists, check if update is needed
-            if entry_needs_update(existing_page, mfp_data):
-                print(f"Changes detected. Updating Notion entry for {date_str}...")
-                update_notion_entry(notion, existing_page['id'], mfp_data)
-            else:
-                print(f"No changes detected. Notion entry for {date_str} is up to date.")
-        else:
-            # 3b. If not exists, create new entry
-            print(f"No existing Notion entry found for {date_str}. Creating new one...")
-            create_notion_entry(notion, NOTION_DATABASE_ID, mfp_data)
+    throttle = NotionThrottle(NOTION_MAX_CONCURRENCY, NOTION_MAX_PER_SECOND)
+    # One HTTP client is shared by the range queries and all writes
+    if NOTION_HTTP2:
+        http_client = httpx.AsyncClient(
+            http2=True, limits=httpx.Limits(max_connections=1, max_keepalive_connections=1)
+        )
+    else:
+        http_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=NOTION_MAX_CONCURRENCY))
+    # Entering notion-client's own context manager would swap in a fresh default
+    # httpx client, so the configured client's lifetime is managed here instead
+    async with http_client:
+        notion = AsyncClient(auth=NOTION_TOKEN, client=http_client)
+        if notion.client is not http_client:
+            # HTTP/2 multiplexing and the connection limit only apply to http_client
+            print("Warning: notion-client is not using the configured HTTP client.")
+        # 1. Look up all existing entries for the synced range in one query
+        print("Checking for existing Notion entries...")
+        try:
+            existing_by_date = await fetch_existing_pages(
+                notion, NOTION_DATABASE_ID, min(dates_to_sync), max(dates_to_sync)
+            )
+            database_props = await get_database_properties(notion, NOTION_DATABASE_ID, existing_by_date)
+        except Exception as e:
+            print(f"Error reading the Notion database: {e}")
+            print("Aborting sync to avoid creating duplicate entries.")
+            return
+
+        # Past days synced recently don't need to be fetched from MyFitnessPal again
+        now = datetime.datetime.now(datetime.timezone.utc)
+        stale_dates = []
+        for target_date in dates_to_sync:
+            existing_page = existing_by_date.get(date_strs[target_date])
+            if target_date < today_local and existing_page and is_recently_synced(existing_page, now):
+                print(f"Skipping {date_strs[target_date]}, synced within the last {SYNC_TTL}.")
+                continue
+            stale_dates.append(target_date)
+
+        if not stale_dates:
+            print("\nAll dates are up to date. MyFitnessPal to Notion sync process finished.")
+            return
+
+        # 2. Get data from MyFitnessPal
+        print("Fetching MyFitnessPal data...")
+        try:
+            mfp_results = await asyncio.to_thread(fetch_mfp_data, stale_dates)
+        except Exception as e:
+            print(f"Failed to initialize MyFitnessPal client: {e}")
+            print("Please ensure you are logged into MyFitnessPal in your web browser,")
+            print("and that the `python-myfitnesspal` library can access its cookies.")
+            print("You might need to install a specific browser cookie library like `pip install browser_cookie3`.")
+            return
+
+        # 3. Sync every fetched date to Notion concurrently
+        tasks = []
+        for target_date, mfp_data in mfp_results.items():
+            date_str = date_strs[target_date]
+            if not mfp_data:
+                print(f"Skipping Notion update for {date_str} due to missing MFP data.")
+                continue
+
+            print(f"MyFitnessPal data for {date_str}: {mfp_data}")
+            tasks.append(process_date(
+                notion, throttle, mfp_data, existing_by_date.get(date_str), target_date < today_local,
+                database_props
+            ))
+        await asyncio.gather(*tasks)
 
     print("\nMyFitnessPal to Notion sync process finished.")
 
 if __name__ == '__main__':
-    main()
+    asyncio.run(main())